@@ -1,11 +1,17 @@
 import logging
 import json
+import heapq
+import itertools
+import queue
+import threading
+import time
 import pyparsing
 import httpx
 from collections import namedtuple
-from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
 from connectai.lark.sdk import Bot
-from mo_sql_parsing import parse as parse_sql, format
+from mo_sql_parsing import parse as parse_sql
 from pep249 import ConnectionPool, Connection as ConnectionBase, Cursor as CursorBase
 
 
@@ -16,6 +22,12 @@ paramstyle = "pyformat"
 
 logger = logging.getLogger(__name__)
 MAX_LIMIT = 20000
+# batch_create/batch_update/batch_delete 单次最多 500 条记录
+MAX_BATCH_SIZE = 500
+# 接口限流时返回的错误码，按 RETRY_INTERVAL 秒指数退避重试
+RATE_LIMIT_CODE = 99991400
+MAX_RETRIES = 3
+RETRY_INTERVAL = 1
 
 
 class ClientMixin:
@@ -39,13 +51,26 @@ class ClientMixin:
             raise Exception(result.get('msg', ''))
         return record_id
 
+    def create_records(self, table_id, records):
+        url = f'{self.host}/open-apis/bitable/v1/apps/{self.app_token}/tables/{table_id}/records/batch_create'
+        result = self.post(url, json={'records': records}).json()
+        if result.get('code', 0) != 0:
+            raise Exception(result.get('msg', ''))
+        return [record.get('record_id') for record in result.get('data', {}).get('records', [])]
+
     def update_records(self, table_id, records):
         url = f'{self.host}/open-apis/bitable/v1/apps/{self.app_token}/tables/{table_id}/records/batch_update'
-        return self.post(url, json={'records': records}).json()
+        result = self.post(url, json={'records': records}).json()
+        if result.get('code', 0) != 0:
+            raise Exception(result.get('msg', ''))
+        return result
 
     def delete_records(self, table_id, records):
         url = f'{self.host}/open-apis/bitable/v1/apps/{self.app_token}/tables/{table_id}/records/batch_delete'
-        return self.post(url, json={'records': records}).json()
+        result = self.post(url, json={'records': records}).json()
+        if result.get('code', 0) != 0:
+            raise Exception(result.get('msg', ''))
+        return result
 
     def get_table_record(self, table_id, data, page_token='', page_size=500):
         url = f'{self.host}/open-apis/bitable/v1/apps/{self.app_token}/tables/{table_id}/records'
@@ -62,12 +87,16 @@ class PersonalBaseClient(ClientMixin):
         self.personal_base_token = personal_base_token
         self.app_token = app_token
         self.host = host
+        self.http = httpx.Client()
 
     def request(self, method, url, headers=None, **kwargs):
         headers = headers or dict()
         if "Authorization" not in headers:
             headers["Authorization"] = "Bearer {}".format(self.personal_base_token)
-        return httpx.request(method, url, headers=headers, **kwargs)
+        return self.http.request(method, url, headers=headers, **kwargs)
+
+    def close(self):
+        self.http.close()
 
     def get(self, url, **kwargs):
         return self.request("GET", url, **kwargs)
@@ -81,17 +110,170 @@ class BotClient(Bot, ClientMixin):
     def __init__(self, *args, app_token='', **kwargs):
         super().__init__(*args, **kwargs)
         self.app_token = app_token
+        self.http = httpx.Client()
+
+    def request(self, method, url, headers=None, **kwargs):
+        headers = headers or dict()
+        if "Authorization" not in headers:
+            headers["Authorization"] = "Bearer {}".format(self.tenant_access_token)
+        return self.http.request(method, url, headers=headers, **kwargs)
+
+    def close(self):
+        self.http.close()
+
+
+class BaseClient(ClientMixin):
+    """One base of a multi-base connection, sending requests through a client shared by every base."""
+
+    def __init__(self, client, app_token):
+        self.client = client
+        self.app_token = app_token
+        self.host = client.host
+
+    def get(self, url, **kwargs):
+        return self.client.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.client.post(url, **kwargs)
 
 
 class NotSupportedError(Exception): pass
 class Error(Exception): pass
 
 
+class WriteBuffer:
+    """Queue of pending mutations, flushed on Connection.commit().
+
+    Updates to the same record are merged, a delete drops any pending update
+    of that record, and the flush sends chunked batch_create/batch_update/
+    batch_delete requests per table. A chunk leaves the queue only after its
+    request succeeded, so a failed commit keeps everything not yet sent.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.inserts = {}  # table_id -> [fields]
+        self.updates = {}  # table_id -> {record_id: fields}
+        self.deletes = {}  # table_id -> {record_id: None}
+
+    def __bool__(self):
+        return bool(self.inserts or self.updates or self.deletes)
+
+    def insert(self, table_id, fields):
+        self.inserts.setdefault(table_id, []).append(fields)
+
+    def update(self, table_id, record_ids, fields):
+        deleted = self.deletes.get(table_id, {})
+        updates = self.updates.setdefault(table_id, {})
+        for record_id in record_ids:
+            if record_id not in deleted:
+                updates.setdefault(record_id, {}).update(fields)
+
+    def delete(self, table_id, record_ids):
+        updates = self.updates.get(table_id, {})
+        deleted = self.deletes.setdefault(table_id, {})
+        for record_id in record_ids:
+            updates.pop(record_id, None)
+            deleted[record_id] = None
+
+    def flush(self, bot):
+        # 每一批发送成功之后才从队列里面移除，失败的时候没有发送的写操作还留在队列里面
+        for table_id in list(self.inserts):
+            items = self.inserts[table_id]
+            while items:
+                chunk = items[:MAX_BATCH_SIZE]
+                logger.debug('batch_create %r %r', table_id, len(chunk))
+                bot.create_records(table_id, [{'fields': fields} for fields in chunk])
+                del items[:len(chunk)]
+            del self.inserts[table_id]
+        for table_id in list(self.updates):
+            items = self.updates[table_id]
+            while items:
+                chunk = list(items)[:MAX_BATCH_SIZE]
+                records = [{'record_id': record_id, 'fields': items[record_id]} for record_id in chunk if items[record_id]]
+                if records:
+                    logger.debug('batch_update %r %r', table_id, len(records))
+                    bot.update_records(table_id, records)
+                for record_id in chunk:
+                    del items[record_id]
+            del self.updates[table_id]
+        for table_id in list(self.deletes):
+            items = self.deletes[table_id]
+            while items:
+                chunk = list(items)[:MAX_BATCH_SIZE]
+                logger.debug('batch_delete %r %r', table_id, len(chunk))
+                bot.delete_records(table_id, chunk)
+                for record_id in chunk:
+                    del items[record_id]
+            del self.deletes[table_id]
+
+
+_SCAN_DONE = object()
+
+
+class _ScanError:
+    def __init__(self, error):
+        self.error = error
+
+
+class _SortKey:
+    """Compare one ORDER BY value, empty values first, desc reverses the order.
+
+    Merging several sorted streams relies on this matching the server's order,
+    which holds for numbers, dates and record_id. Text values compare by code
+    point here and may be ordered differently by bitable.
+    """
+    __slots__ = ('value', 'desc')
+
+    def __init__(self, value, desc):
+        self.value = value
+        self.desc = desc
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        a, b = self.value, other.value
+        if a == b:
+            return False
+        if a is None or b is None:
+            less = a is None
+        else:
+            try:
+                less = a < b
+            except TypeError:
+                less = str(a) < str(b)
+        return not less if self.desc else less
+
+
+def _field_value(item, name):
+    value = item.get(name) if name in item else item.get('fields', {}).get(name)
+    if isinstance(value, list) and len(value) > 0 and isinstance(value[0], dict) and 'text' in value[0]:
+        value = ''.join([l['text'] for l in value])
+    return value
+
+
+def _put(out, item, stop):
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
 class Cursor(CursorBase):
     def __init__(self, connection, return_record_id=False):
         self._connection = connection
         self.yield_per = 500
         self.return_record_id = return_record_id
+        # 设置了partition_by（数字字段）并且parallelism大于1时，select会按字段值分区并发查询
+        self.parallelism = getattr(connection, 'parallelism', 1)
+        self.partition_by = None
+        self.partition_bounds = None
 
     def close(self):
         pass
@@ -115,49 +297,186 @@ class Cursor(CursorBase):
         except pyparsing.ParseException as e:
             raise Exception(query)
 
-        logger.debug("execute %r", parsed_query)
-        if 'select' in parsed_query and 'from' in parsed_query:
-            return self.do_select(parsed_query)
-        elif 'insert' in parsed_query:
-            return self.do_insert(parsed_query)
-        elif 'update' in parsed_query:
-            return self.do_update(parsed_query)
-        elif 'delete' in parsed_query:
-            return self.do_delete(parsed_query)
+        return self.execute_plan(parsed_query)
+
+    def execute_plan(self, plan, parameters=None):
+        """Execute a query AST (the mo_sql_parsing structure) without the SQL text round trip.
+
+        ``{'param': name}`` nodes in the plan are replaced by ``parameters[name]``.
+        """
+        if parameters:
+            plan = self._bind_plan(plan, parameters)
+        logger.debug("execute %r", plan)
+        table_key = 'from' if 'select' in plan else next((k for k in ('insert', 'update', 'delete') if k in plan), None)
+        if table_key in plan:
+            targets = self._connection.route(plan[table_key])
+            if targets != [(self._connection, plan[table_key])]:
+                return self._execute_on(plan, table_key, targets)
+        if 'select' in plan and 'from' in plan:
+            return self.do_select(plan)
+        elif 'insert' in plan:
+            return self.do_insert(plan)
+        elif 'update' in plan:
+            return self.do_update(plan)
+        elif 'delete' in plan:
+            return self.do_delete(plan)
 
         return self
 
+    def _bind_plan(self, plan, parameters):
+        if isinstance(plan, dict):
+            if 'param' in plan and len(plan) == 1:
+                return self._plan_value(parameters[plan['param']])
+            if 'filter_param' in plan and len(plan) == 1:
+                return self._filter_value(parameters[plan['filter_param']])
+            return {k: self._bind_plan(v, parameters) for k, v in plan.items()}
+        elif isinstance(plan, list):
+            return [self._bind_plan(v, parameters) for v in plan]
+        return plan
+
+    def _plan_value(self, v):
+        # 和execute里面_escape之后再解析出来的结构保持一致
+        if isinstance(v, (str, int, bool)):
+            return v
+        return {'literal': json.dumps(v, ensure_ascii=False)}
+
+    def _filter_value(self, v):
+        # where条件里面的字符串按照字面量处理
+        if isinstance(v, (tuple, list)):
+            if not v:
+                # _process_filter会忽略空的IN (...)，变成匹配所有记录
+                raise NotSupportedError('empty IN (...) is not supported')
+            if all(isinstance(i, str) for i in v):
+                return {'literal': list(v)}
+            return [self._filter_value(i) for i in v]
+        # 空字符串和文本方式一样按普通值处理，_process_filter会读取字面量的第一个字符
+        if isinstance(v, str) and v:
+            return {'literal': v}
+        return self._plan_value(v)
+
     def executemany(self, operation, seq_of_parameters):
         for parameters in seq_of_parameters:
             logger.debug(f'executes with parameters {parameters}.')
             self.execute(operation, parameters)
 
-    def _query_all(self, table_id, data):
+    def _get_page(self, table_id, data, page_token='', page_size=500):
+        # 同一个连接上所有并发查询共用一个limiter，限流的时候退避重试
+        for retry in range(MAX_RETRIES + 1):
+            with self._connection.limiter:
+                result = self._connection.bot.get_table_record(table_id, data, page_token=page_token, page_size=page_size)
+            logger.debug("result %r %r --> %r", table_id, data, result)
+            if result.get('code') != RATE_LIMIT_CODE or retry == MAX_RETRIES:
+                break
+            time.sleep(RETRY_INTERVAL * 2 ** retry)
+        if 'error' in result:
+            raise Exception(result['error'].get('message', result.get('msg')))
+        if result.get('code', 0) != 0:
+            raise Exception(result.get('msg', ''))
+        return result
+
+    def _query_pages(self, table_id, data, stop=None):
         page_token, page_size = '', self.yield_per
         while True:
-            result = self._connection.bot.get_table_record(table_id, data, page_token=page_token, page_size=page_size)
-            logger.debug("result %r %r --> %r", table_id, data, result)
-            if 'error' in result:
-                raise Exception(result['error'].get('message', result.get('msg')))
-            for item in result.get('data', {}).get('items', []):
-                if self._offset > 0:
-                    self._offset = self._offset - 1
-                    continue
-                elif self._limit > 0:
-                    # yield item
-                    # yield item['fields']
-                    # 按照self._columns的结构返回数据
-                    names, alias = self._columns
-                    yield self._process_result(item, names, alias)
-                    self._limit = self._limit - 1
-                else:
-                    break
-
-            if result.get('has_more'):
-                page_token = result['page_token']
+            result = self._get_page(table_id, data, page_token=page_token, page_size=page_size)
+            page = result.get('data', {})
+            yield from page.get('items') or []
+
+            if page.get('has_more') and not (stop and stop.is_set()):
+                page_token = page['page_token']
             else:
                 break
 
+    def _limit_result(self, items):
+        for item in items:
+            if self._offset > 0:
+                self._offset = self._offset - 1
+                continue
+            elif self._limit > 0:
+                # yield item
+                # yield item['fields']
+                # 按照self._columns的结构返回数据
+                names, alias = self._columns
+                yield self._process_result(item, names, alias)
+                self._limit = self._limit - 1
+            else:
+                break
+
+    def _edge_value(self, table_id, column, direction):
+        result = self._get_page(table_id, {
+            'field_names': json.dumps([column], ensure_ascii=False),
+            'sort': json.dumps([f'{column} {direction}'], ensure_ascii=False),
+            'filter': f'NOT(CurrentValue.[{column}]="")',
+        }, page_size=1)
+        items = result.get('data', {}).get('items') or []
+        return items[0]['fields'].get(column) if items else None
+
+    def _partition_filters(self, table_id, column):
+        bounds = self.partition_bounds
+        if not bounds:
+            # 没有指定分区边界，就按照字段的最小值和最大值平均切分
+            lo, hi = self._edge_value(table_id, column, 'asc'), self._edge_value(table_id, column, 'desc')
+            if not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in (lo, hi)) or lo >= hi:
+                return []
+            step = (hi - lo) / self.parallelism
+            bounds = [lo + step * i for i in range(1, self.parallelism)]
+
+        field = f'CurrentValue.[{column}]'
+        # 空值单独一个分区，否则会被区间条件漏掉
+        filters = [f'{field}=""']
+        edges = [None] + sorted(bounds) + [None]
+        for lo, hi in zip(edges, edges[1:]):
+            conditions = []
+            if lo is not None:
+                conditions.append(f'{field}>={lo}')
+            if hi is not None:
+                conditions.append(f'{field}<{hi}')
+            filters.append(f'AND({",".join(conditions)})')
+        return filters
+
+    def _produce(self, items, out, stop):
+        try:
+            for item in items:
+                if not _put(out, item, stop):
+                    return
+        except Exception as e:
+            _put(out, _ScanError(e), stop)
+        finally:
+            _put(out, _SCAN_DONE, stop)
+
+    def _drain(self, out, producers):
+        while producers > 0:
+            item = out.get()
+            if item is _SCAN_DONE:
+                producers = producers - 1
+            elif isinstance(item, _ScanError):
+                raise item.error
+            else:
+                yield item
+
+    def _merge_streams(self, streams, orderby, stop):
+        # 每个数据流一个线程，数据流之间没有交集，最后合并成一个结果集
+        executor = ThreadPoolExecutor(max_workers=len(streams))
+        try:
+            if orderby:
+                # 每个数据流的结果已经是有序的，多路归并即可
+                queues = [queue.Queue(maxsize=self.yield_per) for _ in streams]
+                for out, items in zip(queues, streams):
+                    executor.submit(self._produce, items, out, stop)
+                key = lambda item: tuple(_SortKey(_field_value(item, name), desc) for name, desc in orderby)
+                yield from heapq.merge(*[self._drain(out, 1) for out in queues], key=key)
+            else:
+                out = queue.Queue(maxsize=self.yield_per * len(streams))
+                for items in streams:
+                    executor.submit(self._produce, items, out, stop)
+                yield from self._drain(out, len(streams))
+        finally:
+            stop.set()
+            executor.shutdown(wait=False)
+
+    def _parallel_scan(self, table_id, datas, orderby, stop=None):
+        stop = stop or threading.Event()
+        return self._merge_streams([self._query_pages(table_id, data, stop) for data in datas], orderby, stop)
+
     def _process_result(self, item, names, alias):
         Row = namedtuple('Row', alias, rename=True)
         if isinstance(item, (tuple, list)):
@@ -233,7 +552,7 @@ class Cursor(CursorBase):
                 if 'eq' in i:
                     field_name, value = i['eq']
                     if field_name == 'record_id':
-                        record_ids.append(value["literal"])
+                        record_ids.append(value["literal"] if isinstance(value, dict) else value)
                     else:
                         if isinstance(value, dict) and 'literal' in value:
                             if '"' == value["literal"][0]:
@@ -306,21 +625,25 @@ class Cursor(CursorBase):
         return ''.join(filters), record_ids
 
     def do_show_tables(self):
-        tables = self._connection.bot.get_tables()
-        title =f'Tables_in_{self._connection.bot.app_token}'
+        bases = self._connection.bases or {self._connection.bot.app_token: self._connection}
+        title = f'Tables_in_{"_".join(bases)}'
         Row = namedtuple('Row', [title], rename=True)
-        self._result_set = iter([Row(t['table_id']) for t in tables])
+        rows = []
+        for app_token, connection in bases.items():
+            for t in connection.bot.get_tables():
+                # 多个base的时候用 base.table 区分
+                rows.append(Row(f'{app_token}.{t["table_id"]}' if self._connection.bases else t['table_id']))
+        self._result_set = iter(rows)
         self._columns = [title], [title]
         self._offset = 0
-        self._limit = len(tables)
+        self._limit = len(rows)
         return self
 
-    def do_select(self, parsed):
-        table_id = parsed['from']
+    def _set_offset_limit(self, parsed):
         self._offset = int(parsed['offset'].get('literal', 0) if isinstance(parsed.get('offset'), dict) else parsed.get('offset', 0))
         self._limit = int(parsed['limit'].get('literal', MAX_LIMIT) if isinstance(parsed.get('limit'), dict) else parsed.get('limit', MAX_LIMIT))
-        self._columns = self.get_columns(parsed)
 
+    def _get_sort(self, parsed):
         orderby = parsed.get('orderby', [])
         if isinstance(orderby, dict):
             orderby = [orderby]
@@ -330,22 +653,88 @@ class Cursor(CursorBase):
             if field_name in self._columns[1]:
                 field_name = self._columns[0][self._columns[1].index(field_name)]
             sort.append(f"{field_name} {i.get('sort', '')}")
+        return sort
+
+    def do_select(self, parsed):
+        self._set_offset_limit(parsed)
+        self._columns = self.get_columns(parsed)
+        self._result_set = self._limit_result(self._select_items(parsed))
+        return self
+
+    def _select_items(self, parsed, stop=None):
+        # 条件和record_id在这里直接解析，出错的时候execute就会抛出异常，只有分页查询是惰性的
+        # buffered模式下读操作不会提交缓存的写操作，只能读到已经提交的数据
+        table_id = parsed['from']
+        sort = self._get_sort(parsed)
+        orderby = [(i.rsplit(' ', 1)[0], i.endswith('desc')) for i in sort]
 
         # bitable是不支持通过filter查询的，所以检查一下是否有这个字段
         # 如果直接传了record_ids，不管是通过eq还是通过in传递进来的record_ids直接查询
         # TODO 这里可能逻辑上有漏洞
         filter_str, record_ids = self._process_filter(parsed.get('where', {}))
         if len(record_ids) > 0:
-            _, alias = self._columns
             records = [self._connection.bot.get_record_by_id(table_id, record_id) for record_id in record_ids]
-            return self._set_result(alias, records)
+            return iter([record for record in records if record])
 
-        self._result_set = self._query_all(table_id, {
-            'field_names': json.dumps([i for i in self._columns[0] if i not in ['record_id']], ensure_ascii=False),  # record_id
+        # 排序字段也要返回，合并多个有序结果的时候需要用到
+        field_names = [i for i in self._columns[0] if i not in ['record_id']]  # record_id
+        field_names = field_names + [name for name, _ in orderby if name not in field_names and name != 'record_id']
+        data = {
+            'field_names': json.dumps(field_names, ensure_ascii=False),
             'sort': json.dumps(sort, ensure_ascii=False),
             'filter': filter_str,
             'automatic_fields': True,
-        })
+        }
+        partitions = self._partition_filters(table_id, self.partition_by) if self.partition_by and self.parallelism > 1 else []
+        if len(partitions) > 1:
+            datas = [dict(data, filter=f'AND({filter_str},{p})' if filter_str else p) for p in partitions]
+            return self._parallel_scan(table_id, datas, orderby)
+        return self._query_pages(table_id, data, stop)
+
+    def _child_cursor(self, connection):
+        cursor = Cursor(connection, self.return_record_id)
+        cursor.yield_per = self.yield_per
+        cursor.parallelism = self.parallelism
+        cursor.partition_by = self.partition_by
+        cursor.partition_bounds = self.partition_bounds
+        return cursor
+
+    def _execute_on(self, plan, table_key, targets):
+        # 表在其他base里面（base.table），或者需要在多个base里面执行
+        cursors = [self._child_cursor(connection) for connection, _ in targets]
+        plans = [dict(plan, **{table_key: table_id}) for _, table_id in targets]
+        if table_key == 'from':
+            return self.do_fanout_select(cursors, plans)
+        # record_id只在一个base里面有效，写操作必须指定base
+        if len(targets) > 1:
+            raise NotSupportedError(f'{table_key} {plan[table_key]} matches {len(targets)} bases, use base.table')
+        cursor = cursors[0]
+        result = cursor.execute_plan(plans[0])
+        self.lastrowid = getattr(cursor, 'lastrowid', None)
+        self.rowcount = getattr(cursor, 'rowcount', 1)
+        if table_key == 'insert':
+            return result
+        self._columns = cursor._columns if hasattr(cursor, '_columns') else (['record_id'], ['record_id'])
+        self._result_set = cursor
+        return self
+
+    def do_fanout_select(self, cursors, plans):
+        self._set_offset_limit(plans[0])
+        # 每个base的表结构是一样的，只需要取一次字段
+        self._columns = cursors[0].get_columns(plans[0])
+        # 每个base最多只需要返回 offset + limit 条记录
+        page_size = max(1, min(self.yield_per, self._offset + self._limit))
+        for cursor in cursors:
+            cursor._columns = self._columns
+            cursor.yield_per = page_size
+        sort = self._get_sort(plans[0])
+        orderby = [(i.rsplit(' ', 1)[0], i.endswith('desc')) for i in sort]
+        stop = threading.Event()
+        streams = [itertools.islice(cursor._select_items(sub_plan, stop), self._offset + self._limit) for cursor, sub_plan in zip(cursors, plans)]
+        if len(streams) == 1:
+            self._result_set = self._limit_result(streams[0])
+        else:
+            self._result_set = self._limit_result(self._merge_streams(streams, orderby, stop))
         return self
 
     def do_insert(self, parsed):
@@ -361,6 +750,12 @@ class Cursor(CursorBase):
             else:
                 fields[column] = value
 
+        if self._connection.buffered:
+            # 缓存模式下，record_id要等commit之后才会生成
+            self._connection.write_buffer.insert(parsed['insert'], fields)
+            self.rowcount = 1
+            self.lastrowid = None
+            return self.lastrowid
         self.lastrowid = self._connection.bot.create_record(parsed['insert'], fields)
         return self.lastrowid
 
@@ -375,9 +770,8 @@ class Cursor(CursorBase):
         if len(record_ids):
             return record_ids
 
-        sql = format({ 'from': table_id, 'where': where, 'select': [{ 'value': 'record_id' }] })
         cursor = Cursor(self._connection)
-        cursor.execute(sql)
+        cursor.execute_plan({'from': table_id, 'where': where, 'select': [{'value': 'record_id'}]})
         records = cursor.fetchall()
         return [record.record_id for record in records]
 
@@ -394,7 +788,10 @@ class Cursor(CursorBase):
         self.rowcount = len(record_ids)
         self._columns = ['record_id'], ['record_id']
         if self.rowcount > 0:
-            self._connection.bot.update_records(table_id, records)
+            if self._connection.buffered:
+                self._connection.write_buffer.update(table_id, record_ids, fields)
+            else:
+                self._connection.bot.update_records(table_id, records)
         return self._set_result(['record_id'], [(record_id,) for record_id in record_ids])
 
     def do_delete(self, parsed):
@@ -403,7 +800,10 @@ class Cursor(CursorBase):
         logger.debug('delete %r %r', table_id, record_ids)
         self.rowcount = len(record_ids)
         if self.rowcount > 0:
-            self._connection.bot.delete_records(table_id, record_ids)
+            if self._connection.buffered:
+                self._connection.write_buffer.delete(table_id, record_ids)
+            else:
+                self._connection.bot.delete_records(table_id, record_ids)
         return self._set_result(['record_id'], [(record_id,) for record_id in record_ids])
 
     def fetchone(self):
@@ -429,10 +829,21 @@ class Cursor(CursorBase):
 class Connection(ConnectionBase):
     # bitable+pybitable://<app_id>:<app_secret>@open.feishu.cn/<app_token>
     # bitable+pybitable://<personal_base_token>@base-api.feishu.cn/<app_token>
-    def __init__(self, connect_string, return_record_id=True, **kwargs):
+    # bitable+pybitable://<personal_base_token>@base-api.feishu.cn/<app_token>?buffered=true
+    # bitable+pybitable://<app_id>:<app_secret>@open.feishu.cn/<app_token1>,<app_token2>
+    def __init__(self, connect_string, return_record_id=True, buffered=False, parallelism=None, **kwargs):
         self.return_record_id = return_record_id
+        self.buffered = _as_bool(buffered)
+        self.parallelism = int(parallelism or 1)
+        self.write_buffer = WriteBuffer()
         if connect_string:
             result = urlparse(connect_string)
+            query = parse_qs(result.query)
+            if 'buffered' in query:
+                self.buffered = _as_bool(query['buffered'][-1])
+            if 'parallelism' in query:
+                parallelism = query['parallelism'][-1]
+                self.parallelism = int(parallelism)
             self.app_id = result.username
             self.app_secret = result.password
             self.host = result.hostname
@@ -443,31 +854,99 @@ class Connection(ConnectionBase):
             self.app_secret = kwargs.get('password', '')
             self.host = kwargs.get('host', '')
             self.app_token = kwargs.get('database', '')
+            if isinstance(self.app_token, (list, tuple)):
+                self.app_token = ','.join(self.app_token)
+        # 多个app_token用逗号分隔，每个base一个连接，表名用 base.table 指定
+        self.app_tokens = [i for i in (self.app_token or '').split(',') if i]
+        # 同一时间最多 parallelism 个查询请求，多个base没有指定parallelism的时候每个base可以同时查询
+        self.limiter = threading.BoundedSemaphore(max(1, int(parallelism) if parallelism else len(self.app_tokens)))
+        self.bases = {}
+        self._table_ids = None
+        if len(self.app_tokens) > 1:
+            # 所有base共用一个client（同一个access_token和httpx连接池）和一个limiter
+            client = self._client = self._create_client(self.app_tokens[0])
+            for app_token in self.app_tokens:
+                self.bases[app_token] = Connection(
+                    '', return_record_id=return_record_id, buffered=self.buffered, parallelism=self.parallelism,
+                    host=self.host, username=self.app_id, password=self.app_secret, database=app_token,
+                    bot=BaseClient(client, app_token),
+                )
+                self.bases[app_token].limiter = self.limiter
+            self.app_token = self.app_tokens[0]
+            self.bot = self.bases[self.app_token].bot
+        elif 'bot' in kwargs:
+            # 多个base里面的一个，client由外层连接负责关闭
+            self._client = None
+            self.bot = kwargs['bot']
+        else:
+            self.bot = self._client = self._create_client(self.app_token)
+
+    def _create_client(self, app_token):
         if self.app_id and self.app_secret:
-            self.bot = BotClient(
+            return BotClient(
                 app_id=self.app_id,
                 app_secret=self.app_secret,
-                app_token=self.app_token,
-                host=f"https://{self.host}",
-            )
-        else:
-            # 使用个人授权码可以直接调用
-            self.bot = PersonalBaseClient(
-                personal_base_token=self.app_id or self.app_secret,
-                app_token=self.app_token,
+                app_token=app_token,
                 host=f"https://{self.host}",
             )
+        # 使用个人授权码可以直接调用
+        return PersonalBaseClient(
+            personal_base_token=self.app_id or self.app_secret,
+            app_token=app_token,
+            host=f"https://{self.host}",
+        )
+
+    def resolve_table(self, table):
+        # 支持用表名代替table_id，不同base里面同名表的table_id不一样
+        if self._table_ids is None:
+            self._table_ids = {t['name']: t['table_id'] for t in self.bot.get_tables() if 'name' in t}
+        return self._table_ids.get(table, table)
+
+    def route(self, table):
+        """Return the (connection, table_id) pairs a table name refers to.
+
+        Without multiple bases this is always the table itself. With multiple bases
+        ``base.table`` picks one base and a bare table name means every base.
+        """
+        base, _, name = table.rpartition('.')
+        if not self.bases:
+            return [(self, name if base == self.app_token else table)]
+        if base:
+            if base not in self.bases:
+                raise Error(f'unknown base {base}')
+            return [(self.bases[base], self.bases[base].resolve_table(name))]
+        return [(connection, connection.resolve_table(table)) for connection in self.bases.values()]
+
+    def flush(self):
+        for connection in self.bases.values():
+            connection.flush()
+        if self.write_buffer:
+            self.write_buffer.flush(self.bot)
 
     def commit(self):
-        pass
+        self.flush()
 
     def rollback(self):
-        pass
+        for connection in self.bases.values():
+            connection.rollback()
+        self.write_buffer.clear()
+
+    def close(self):
+        # 多个base共用一个client，只需要关闭一次
+        if self._client is not None:
+            self._client.close()
+            self._client = None
 
     def cursor(self):
         return Cursor(self, self.return_record_id)
 
 
+def _as_bool(value):
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
 def connect(connection_string: str = "", **kwargs) -> Connection:
     """Connect to a Lark BITable, returning a connection."""
     return Connection(connection_string, **kwargs)
@@ -1,9 +1,14 @@
 from sqlalchemy import exc, pool, types, inspect
 from sqlalchemy.engine import default
-from sqlalchemy.sql import compiler
+from sqlalchemy.sql import compiler, elements, operators, schema, selectable, dml
+from sqlalchemy.util import memoized_property
 
 
 
+class _PlanUnsupported(Exception):
+    """The statement uses something PlanBuilder cannot express, execute it as text."""
+
+
 class BITableCompiler(compiler.SQLCompiler):
 
     def visit_column(self, column, **kwargs):
@@ -14,6 +19,175 @@ class BITableCompiler(compiler.SQLCompiler):
     def _inserted_primary_key_from_lastrowid_getter(self, lastrowid, *args, **kwargs):
         return [lastrowid]
 
+    @memoized_property
+    def plan(self):
+        """The statement as a query AST for Cursor.execute_plan, None when it can only be run as text."""
+        try:
+            return PlanBuilder(self).build()
+        except _PlanUnsupported:
+            return None
+
+
+class PlanBuilder:
+    """Build the mo_sql_parsing structure of a compiled statement directly from the Core construct.
+
+    Bound values are left as ``{'param': name}`` (``{'filter_param': name}`` inside WHERE)
+    and resolved by the cursor from the execution parameters.
+    """
+
+    comparisons = {
+        operators.eq: 'eq',
+        operators.ne: 'neq',
+        operators.lt: 'lt',
+        operators.le: 'lte',
+        operators.gt: 'gt',
+        operators.ge: 'gte',
+        operators.like_op: 'like',
+        operators.in_op: 'in',
+    }
+
+    def __init__(self, compiled):
+        self.compiled = compiled
+        compile_state = getattr(compiled, 'compile_state', None)
+        self.statement = compile_state.statement if compile_state is not None else compiled.statement
+
+    def build(self):
+        statement = self.statement
+        if isinstance(statement, selectable.Select):
+            return self.build_select(statement)
+        elif isinstance(statement, dml.Insert):
+            return self.build_insert(statement)
+        elif isinstance(statement, dml.Update):
+            return self.build_update(statement)
+        elif isinstance(statement, dml.Delete):
+            return self.build_delete(statement)
+        raise _PlanUnsupported(statement)
+
+    def build_select(self, statement):
+        froms = statement.get_final_froms()
+        if len(froms) != 1 or not isinstance(froms[0], schema.Table):
+            raise _PlanUnsupported(froms)
+        if statement._group_by_clauses or statement._having_criteria or statement._distinct:
+            raise _PlanUnsupported(statement)
+        plan = {
+            'select': [self.build_column(c) for c in statement.selected_columns],
+            'from': self.table_name(froms[0]),
+        }
+        if statement.whereclause is not None:
+            plan['where'] = self.build_where(statement.whereclause)
+        if statement._order_by_clauses:
+            plan['orderby'] = [self.build_order_by(c) for c in statement._order_by_clauses]
+        if statement._limit_clause is not None:
+            plan['limit'] = self.build_value(statement._limit_clause)
+        if statement._offset_clause is not None:
+            plan['offset'] = self.build_value(statement._offset_clause)
+        return plan
+
+    def build_insert(self, statement):
+        if statement._multi_values or statement._select_names or statement._returning:
+            raise _PlanUnsupported(statement)
+        columns = self.crud_params(statement, self.compiled.insert_prefetch)
+        return {
+            'insert': self.table_name(statement.table),
+            'columns': [name for name, _ in columns],
+            'query': {'select': [{'value': value} for _, value in columns]},
+        }
+
+    def build_update(self, statement):
+        if statement._returning:
+            raise _PlanUnsupported(statement)
+        plan = {
+            'update': self.table_name(statement.table),
+            'set': dict(self.crud_params(statement, self.compiled.update_prefetch)),
+        }
+        if statement.whereclause is not None:
+            plan['where'] = self.build_where(statement.whereclause)
+        return plan
+
+    def build_delete(self, statement):
+        if statement._returning:
+            raise _PlanUnsupported(statement)
+        plan = {'delete': self.table_name(statement.table)}
+        if statement.whereclause is not None:
+            plan['where'] = self.build_where(statement.whereclause)
+        return plan
+
+    def crud_params(self, statement, prefetch):
+        # 和crud._get_crud_params生成的参数名保持一致：字面量用字段名，bindparam用自己的名字
+        if statement._values:
+            values = {}
+            for key, value in statement._values.items():
+                key = key if isinstance(key, str) else key.key
+                if not isinstance(value, elements.BindParameter):
+                    raise _PlanUnsupported(value)
+                values[key] = key if isinstance(value.key, elements._anonymous_label) else value.key
+        else:
+            values = {key: key for key in self.compiled.column_keys or []}
+        for column in prefetch:
+            values.setdefault(column.key, column.key)
+
+        params = []
+        for column in statement.table.columns:
+            if column.key in values:
+                name = values[column.key]
+                if name not in self.compiled.binds:
+                    raise _PlanUnsupported(name)
+                params.append((column.name, {'param': name}))
+        return params
+
+    def table_name(self, table):
+        # schema对应多个base连接里面的app_token
+        return f'{table.schema}.{table.name}' if table.schema else table.name
+
+    def build_column(self, column):
+        if isinstance(column, elements.Label):
+            return {'value': self.column_name(column.element), 'name': column.name}
+        return {'value': self.column_name(column)}
+
+    def column_name(self, column):
+        if isinstance(column, elements.ColumnClause) and not isinstance(column, elements.Label):
+            return column.name
+        raise _PlanUnsupported(column)
+
+    def build_order_by(self, clause):
+        sort = None
+        if isinstance(clause, elements.UnaryExpression) and clause.modifier in (operators.desc_op, operators.asc_op):
+            sort = 'desc' if clause.modifier is operators.desc_op else 'asc'
+            clause = clause.element
+        if isinstance(clause, elements._label_reference):
+            clause = clause.element
+        if isinstance(clause, elements.Label):
+            name = clause.name
+        else:
+            name = self.column_name(clause)
+        return {'value': name, 'sort': sort} if sort else {'value': name}
+
+    def build_value(self, value, key='param'):
+        if isinstance(value, elements.BindParameter):
+            return {key: self.compiled.bind_names[value]}
+        raise _PlanUnsupported(value)
+
+    def build_where(self, clause):
+        if isinstance(clause, elements.Grouping):
+            return self.build_where(clause.element)
+        if isinstance(clause, elements.BooleanClauseList):
+            conjunction = {operators.and_: 'and', operators.or_: 'or'}.get(clause.operator)
+            if not conjunction:
+                raise _PlanUnsupported(clause)
+            return {conjunction: [self.build_where(c) for c in clause.clauses]}
+        if isinstance(clause, elements.UnaryExpression) and clause.operator is operators.inv:
+            return {'not': self.build_where(clause.element)}
+        if isinstance(clause, elements.BinaryExpression):
+            name = self.column_name(clause.left)
+            if isinstance(clause.right, elements.Null):
+                if clause.operator is operators.is_:
+                    return {'missing': name}
+                elif clause.operator is operators.is_not:
+                    return {'exists': name}
+            elif clause.operator in self.comparisons:
+                return {self.comparisons[clause.operator]: [name, self.build_value(clause.right, 'filter_param')]}
+        raise _PlanUnsupported(clause)
+
 
 class BITableTypeCompiler(compiler.GenericTypeCompiler): pass
 
@@ -42,9 +216,11 @@ class BITableDialect(default.DefaultDialect):
     supports_statement_cache = True
     postfetch_lastrowid = True  # 设置这个参数，配合前面的getter，确保插入之后的记录会有record_id
 
-    def __init__(self, **kw):
+    def __init__(self, compile_plan=False, **kw):
         default.DefaultDialect.__init__(self, **kw)
         self.supported_extensions = []
+        # 直接把Core语句编译成查询结构交给cursor.execute_plan执行，跳过SQL文本的解析
+        self.compile_plan = compile_plan
 
     @classmethod
     def dbapi(cls):
@@ -52,9 +228,58 @@ class BITableDialect(default.DefaultDialect):
 
         return module
 
+    def _plan(self, context):
+        compiled = getattr(context, 'compiled', None) if self.compile_plan else None
+        return compiled.plan if isinstance(compiled, BITableCompiler) else None
+
+    def _plan_parameters(self, context, parameters):
+        # parameters是已经经过bind processor处理的值，key是转义之后的参数名，
+        # IN (...) 这种expanding参数已经被展开成了 name_1, name_2...，这里再合并回列表
+        compiled = context.compiled
+        escaped_bind_names = compiled.escaped_bind_names or {}
+        values = {}
+        for name, bind in compiled.binds.items():
+            key = escaped_bind_names.get(name, name)
+            if key in parameters:
+                values[name] = parameters[key]
+            elif bind.expanding:
+                values[name], index = [], 1
+                while f'{key}_{index}' in parameters:
+                    values[name].append(parameters[f'{key}_{index}'])
+                    index = index + 1
+                # 空的IN (...)不能转换成filter，否则会变成不限制条件，交给文本方式处理
+                if not values[name]:
+                    raise _PlanUnsupported(name)
+        return values
+
+    def do_execute(self, cursor, statement, parameters, context=None):
+        plan = self._plan(context)
+        try:
+            plan_parameters = self._plan_parameters(context, parameters) if plan is not None else None
+        except _PlanUnsupported:
+            plan = None
+        if plan is None:
+            return super().do_execute(cursor, statement, parameters, context)
+        cursor.execute_plan(plan, plan_parameters)
+
+    def do_executemany(self, cursor, statement, parameters, context=None):
+        plan = self._plan(context)
+        try:
+            plan_parameters = [self._plan_parameters(context, p) for p in parameters] if plan is not None else None
+        except _PlanUnsupported:
+            plan = None
+        if plan is None:
+            return super().do_executemany(cursor, statement, parameters, context)
+        for processed_parameters in plan_parameters:
+            cursor.execute_plan(plan, processed_parameters)
+
+    def do_close(self, dbapi_connection):
+        # 释放连接上的httpx连接池，连接池dispose的时候会调用
+        dbapi_connection.close()
+
     def do_rollback(self, dbapi_connection):
-        # No transactions for BITable
-        pass
+        # BITable没有事务，这里只是丢弃buffered模式下缓存的写操作
+        dbapi_connection.rollback()
 
     def get_foreign_keys(self, connection, table_name, schema=None, **kw):
         """BITable has no support for foreign keys.  Returns an empty list."""
@@ -0,0 +1,103 @@
+import re
+import json
+
+import pytest
+
+from pybitable import dbapi
+
+
+class FakeClient:
+    """In-memory stand-in for the bitable clients, recording every API call."""
+
+    def __init__(self, app_token='app', tables=None, names=None):
+        self.app_token = app_token
+        self.tables = tables or {}  # table_id -> [record]
+        self.names = names or {}  # table_id -> table name
+        self.calls = []
+        self.fail = {}  # method -> exception message, get_table_record -> [error response]
+
+    def _check(self, method):
+        if method in self.fail:
+            raise Exception(self.fail[method])
+
+    def get_tables(self):
+        self.calls.append(('get_tables',))
+        return [{'table_id': t, 'name': self.names.get(t, t)} for t in self.tables]
+
+    def get_columns(self, table_id):
+        fields = {}
+        for record in self.tables[table_id]:
+            fields.update(dict.fromkeys(record['fields']))
+        return [{'field_name': name} for name in fields]
+
+    def create_records(self, table_id, records):
+        self.calls.append(('batch_create', table_id, len(records)))
+        self._check('create_records')
+        return [f'new{i}' for i in range(len(records))]
+
+    def create_record(self, table_id, fields):
+        self.calls.append(('create', table_id, fields))
+        return 'new'
+
+    def update_records(self, table_id, records):
+        self.calls.append(('batch_update', table_id, records))
+        self._check('update_records')
+        return {'code': 0}
+
+    def delete_records(self, table_id, records):
+        self.calls.append(('batch_delete', table_id, records))
+        self._check('delete_records')
+        return {'code': 0}
+
+    def get_record_by_id(self, table_id, record_id):
+        self.calls.append(('get_record', table_id, record_id))
+        self._check('get_record_by_id')
+        return next((r for r in self.tables[table_id] if r['record_id'] == record_id), {})
+
+    def get_table_record(self, table_id, data, page_token='', page_size=500):
+        self.calls.append(('records', table_id, data.get('filter', ''), page_token))
+        if self.fail.get('get_table_record'):
+            return self.fail['get_table_record'].pop(0)
+        items = [r for r in self.tables[table_id] if _match(data.get('filter', ''), r['fields'])]
+        for sort in reversed(json.loads(data.get('sort') or '[]')):
+            name, _, direction = sort.rpartition(' ')
+            items = sorted(items, key=lambda r: (r['fields'].get(name) is not None, r['fields'].get(name)), reverse=direction == 'desc')
+        start = int(page_token or 0)
+        return {'code': 0, 'data': {
+            'items': items[start:start + page_size],
+            'has_more': start + page_size < len(items),
+            'page_token': str(start + page_size),
+        }}
+
+
+def _match(formula, fields):
+    # 只支持测试里面用到的条件：[NOT(]CurrentValue.[x]=""、>=、<、="v"，全部按AND处理
+    for negate, name, op, value in re.findall(r'(NOT\()?CurrentValue\.\[(.+?)\](>=|<=|>|<|=)("[^"]*"|[-\d.]+)', formula):
+        current = fields.get(name)
+        if value.startswith('"'):
+            value = json.loads(value)
+            ok = (current in (None, '')) if value == '' else current == value
+        else:
+            ok = current is not None and {
+                '>=': current >= float(value), '<=': current <= float(value),
+                '>': current > float(value), '<': current < float(value), '=': current == float(value),
+            }[op]
+        if ok == bool(negate):
+            return False
+    return True
+
+
+def make_records(prefix, values, field='n'):
+    return [{'record_id': f'{prefix}{i}', 'fields': {field: v, 'a': f'{prefix}{i}'}} for i, v in enumerate(values)]
+
+
+@pytest.fixture
+def connect():
+    def connect(connect_string='bitable+pybitable://:token@host/app', clients=None, **kwargs):
+        connection = dbapi.connect(connect_string, **kwargs)
+        bases = connection.bases or {connection.app_token: connection}
+        for app_token, base in bases.items():
+            base.bot = (clients or {}).get(app_token) or FakeClient(app_token)
+        connection.bot = connection.bases[connection.app_token].bot if connection.bases else connection.bot
+        return connection
+    return connect
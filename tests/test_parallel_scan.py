@@ -0,0 +1,105 @@
+import random
+import threading
+
+import pytest
+
+from pybitable import dbapi
+
+from conftest import make_records
+
+
+@pytest.fixture
+def table(connect):
+    random.seed(0)
+    connection = connect('bitable+pybitable://:token@host/app?parallelism=4')
+    values = [random.randint(0, 1000) for _ in range(1200)] + [None] * 30
+    connection.bot.tables['tbl'] = make_records('r', values)
+    return connection, values
+
+
+def test_partition_filters_split_value_range(connect):
+    cursor = connect().cursor()
+    cursor.partition_bounds = [20, 10]
+    assert cursor._partition_filters('tbl', 'n') == [
+        'CurrentValue.[n]=""',
+        'AND(CurrentValue.[n]<10)',
+        'AND(CurrentValue.[n]>=10,CurrentValue.[n]<20)',
+        'AND(CurrentValue.[n]>=20)',
+    ]
+
+
+def test_partition_filters_from_min_max(table):
+    connection, _ = table
+    connection.bot.tables['tbl'] = make_records('r', [0, 100, None])
+    cursor = connection.cursor()
+    assert cursor._partition_filters('tbl', 'n')[1:] == [
+        'AND(CurrentValue.[n]<25.0)',
+        'AND(CurrentValue.[n]>=25.0,CurrentValue.[n]<50.0)',
+        'AND(CurrentValue.[n]>=50.0,CurrentValue.[n]<75.0)',
+        'AND(CurrentValue.[n]>=75.0)',
+    ]
+
+
+def test_parallel_scan_returns_every_record_once(table):
+    connection, values = table
+    cursor = connection.cursor()
+    cursor.partition_by = 'n'
+    cursor.yield_per = 100
+    cursor.execute('select record_id, n from tbl')
+    rows = cursor.fetchall()
+    assert sorted(row.record_id for row in rows) == sorted(f'r{i}' for i in range(len(values)))
+
+
+def test_parallel_scan_merges_order_by_with_offset_limit(table):
+    connection, values = table
+    cursor = connection.cursor()
+    cursor.partition_by = 'n'
+    cursor.yield_per = 100
+    cursor.execute('select n from tbl order by n desc limit 50 offset 10')
+    expected = sorted([v for v in values if v is not None], reverse=True)[10:60]
+    assert [row.n for row in cursor.fetchall()] == expected
+
+
+def test_rate_limited_page_is_retried(table, monkeypatch):
+    monkeypatch.setattr(dbapi.time, 'sleep', lambda seconds: None)
+    connection, values = table
+    connection.bot.fail['get_table_record'] = [{'code': dbapi.RATE_LIMIT_CODE, 'msg': 'too many requests'}]
+    cursor = connection.cursor()
+    cursor.execute('select n from tbl')
+    assert len(cursor.fetchall()) == len(values)
+
+
+def test_failed_page_raises_instead_of_truncating(table):
+    connection, _ = table
+    cursor = connection.cursor()
+    cursor.yield_per = 100
+    cursor.execute('select n from tbl')
+    connection.bot.fail['get_table_record'] = [{'code': 1254000, 'msg': 'WrongRequestBody'}]
+    with pytest.raises(Exception, match='WrongRequestBody'):
+        cursor.fetchall()
+
+
+def test_concurrent_requests_share_connection_limiter(table):
+    connection, _ = table
+    active, peak, lock = [0], [0], threading.Lock()
+    get_table_record = connection.bot.get_table_record
+
+    def counting(*args, **kwargs):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        try:
+            threading.Event().wait(0.001)
+            return get_table_record(*args, **kwargs)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    connection.bot.get_table_record = counting
+    cursor = connection.cursor()
+    cursor.partition_by = 'n'
+    cursor.partition_bounds = list(range(100, 1000, 100))
+    cursor.yield_per = 20
+    cursor.execute('select n from tbl')
+    assert len(cursor.fetchall()) == 1230
+    assert peak[0] <= connection.parallelism
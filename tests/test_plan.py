@@ -0,0 +1,103 @@
+import pytest
+
+sqlalchemy = pytest.importorskip('sqlalchemy')
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, TypeDecorator, and_, create_engine, delete, func, insert, select, update
+from sqlalchemy.dialects import registry
+
+from pybitable import dbapi
+from pybitable.dialect import BITableDialect, PlanBuilder
+
+from conftest import make_records
+
+registry.register('bitable.pybitable', 'pybitable.dialect', 'BITableDialect')
+
+
+class Upper(TypeDecorator):
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return value.upper() if value is not None else value
+
+
+metadata = MetaData()
+tbl = Table('tbl', metadata, Column('record_id', String, primary_key=True), Column('a', String), Column('n', Integer), Column('u', Upper))
+
+statements = [
+    select(tbl.c.a.label('b'), tbl.c.n).where(and_(tbl.c.a == 'r1', tbl.c.n.is_not(None))).order_by(tbl.c.n.desc()).limit(5).offset(0),
+    select(tbl.c.a).where(tbl.c.n.is_(None)),
+    select(tbl.c.a).where(tbl.c.a == ''),
+    select(tbl.c.a).where(tbl.c.record_id.in_(['r0', 'r1'])),
+    insert(tbl).values(a='x', n=1, u='hello'),
+    update(tbl).where(tbl.c.record_id == 'r0').values(n=2, u='hi'),
+    update(tbl).where(tbl.c.a == 'r1').values(a='y'),
+    delete(tbl).where(tbl.c.a == 'r1'),
+]
+
+
+def run(connect, compile_plan, statement):
+    connection = connect()
+    connection.bot.tables['tbl'] = make_records('r', [1, 2])
+    engine = create_engine('bitable+pybitable://', creator=lambda: connection, compile_plan=compile_plan)
+    with engine.connect() as conn:
+        result = conn.execute(statement)
+        rows = result.fetchall() if result.returns_rows else result.rowcount
+    return rows, connection.bot.calls
+
+
+@pytest.mark.parametrize('statement', statements, ids=lambda s: str(s).split()[0])
+def test_plan_matches_text_path(connect, statement):
+    assert statement.compile(dialect=BITableDialect(paramstyle='pyformat')).plan is not None
+    assert run(connect, True, statement) == run(connect, False, statement)
+
+
+def test_plan_applies_bind_processors(connect):
+    _, calls = run(connect, True, insert(tbl).values(a='x', u='hello'))
+    assert calls == [('create', 'tbl', {'a': 'x', 'u': 'HELLO'})]
+
+
+def test_plan_is_built_once_per_compiled_statement():
+    compiled = statements[0].compile(dialect=BITableDialect(paramstyle='pyformat'))
+    assert compiled.plan is compiled.plan
+    assert compiled.plan['from'] == 'tbl'
+    assert compiled.plan['limit'] == {'param': 'param_1'}
+
+
+def test_unsupported_statement_falls_back_to_text():
+    dialect = BITableDialect(paramstyle='pyformat')
+    assert select(func.count(tbl.c.a)).compile(dialect=dialect).plan is None
+    assert select(tbl.c.a).group_by(tbl.c.a).compile(dialect=dialect).plan is None
+
+
+@pytest.mark.parametrize('statement', [
+    select(tbl.c.a).where(tbl.c.record_id.in_([])),
+    update(tbl).where(and_(tbl.c.a == 'r1', tbl.c.record_id.in_([]))).values(a='y'),
+    delete(tbl).where(tbl.c.record_id.in_([])),
+    delete(tbl).where(and_(tbl.c.a == 'r1', tbl.c.record_id.in_([]))),
+], ids=lambda s: str(s).split()[0])
+def test_empty_in_never_matches_every_record(connect, statement):
+    connection = connect()
+    connection.bot.tables['tbl'] = make_records('r', [1, 2, 3])
+    engine = create_engine('bitable+pybitable://', creator=lambda: connection, compile_plan=True)
+    with pytest.raises(Exception):
+        with engine.connect() as conn:
+            conn.execute(statement).fetchall()
+    assert not [call for call in connection.bot.calls if call[0] in ('records', 'batch_update', 'batch_delete')]
+
+
+def test_execute_plan_rejects_empty_in(connect):
+    cursor = connect().cursor()
+    plan = {'delete': 'tbl', 'where': {'in': ['record_id', {'filter_param': 'ids'}]}}
+    with pytest.raises(dbapi.NotSupportedError):
+        cursor.execute_plan(plan, {'ids': []})
+
+
+def test_engine_dispose_closes_connection():
+    connection = dbapi.connect('bitable+pybitable://:token@host/app')
+    http = connection.bot.http
+    engine = create_engine('bitable+pybitable://', creator=lambda: connection)
+    with engine.connect():
+        pass
+    engine.dispose()
+    assert http.is_closed
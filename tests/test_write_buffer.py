@@ -0,0 +1,83 @@
+import pytest
+
+from pybitable.dbapi import WriteBuffer, MAX_BATCH_SIZE
+
+from conftest import FakeClient, make_records
+
+
+def test_updates_to_same_record_are_merged():
+    buffer = WriteBuffer()
+    buffer.update('tbl', ['r1', 'r2'], {'a': 1})
+    buffer.update('tbl', ['r1'], {'b': 2})
+    buffer.update('tbl', ['r1'], {'a': 3})
+    assert buffer.updates == {'tbl': {'r1': {'a': 3, 'b': 2}, 'r2': {'a': 1}}}
+
+
+def test_delete_drops_pending_and_later_updates():
+    buffer = WriteBuffer()
+    buffer.update('tbl', ['r1'], {'a': 1})
+    buffer.delete('tbl', ['r1'])
+    buffer.update('tbl', ['r1'], {'a': 2})
+    assert buffer.updates == {'tbl': {}}
+    assert list(buffer.deletes['tbl']) == ['r1']
+
+
+def test_flush_sends_chunked_batches_and_empties_queue():
+    buffer, bot = WriteBuffer(), FakeClient()
+    for i in range(MAX_BATCH_SIZE + 1):
+        buffer.update('tbl', [f'r{i}'], {'a': i})
+    buffer.insert('tbl', {'a': 'new'})
+    buffer.delete('tbl2', ['x'])
+    buffer.flush(bot)
+    assert [(c[0], len(c[2]) if isinstance(c[2], list) else c[2]) for c in bot.calls] == [
+        ('batch_create', 1), ('batch_update', MAX_BATCH_SIZE), ('batch_update', 1), ('batch_delete', 1),
+    ]
+    assert not buffer
+
+
+def test_failed_flush_keeps_unsent_writes():
+    buffer, bot = WriteBuffer(), FakeClient()
+    for i in range(MAX_BATCH_SIZE + 1):
+        buffer.update('tbl', [f'r{i}'], {'a': i})
+    buffer.delete('tbl', ['x'])
+    bot.fail['update_records'] = 'rate limited'
+    with pytest.raises(Exception, match='rate limited'):
+        buffer.flush(bot)
+    assert len(buffer.updates['tbl']) == MAX_BATCH_SIZE + 1
+    assert list(buffer.deletes['tbl']) == ['x']
+
+    del bot.fail['update_records']
+    bot.calls.clear()
+    buffer.flush(bot)
+    assert [c[0] for c in bot.calls] == ['batch_update', 'batch_update', 'batch_delete']
+    assert not buffer
+
+
+def test_buffered_connection_merges_until_commit(connect):
+    connection = connect('bitable+pybitable://:token@host/app?buffered=true')
+    bot = connection.bot
+    bot.tables['tbl'] = make_records('r', [1, 2])
+    cursor = connection.cursor()
+    cursor.execute("update tbl set a='1' where record_id='r0'")
+    cursor.execute("update tbl set b='2' where record_id='r0'")
+    # 按条件查找record_id不会提交缓存的写操作
+    cursor.execute("update tbl set c='3' where a='r1'")
+    assert cursor.rowcount == 1
+    assert [c[0] for c in bot.calls] == ['records']
+
+    connection.commit()
+    assert bot.calls[-1] == ('batch_update', 'tbl', [
+        {'record_id': 'r0', 'fields': {'a': 1, 'b': 2}},
+        {'record_id': 'r1', 'fields': {'c': 3}},
+    ])
+
+
+def test_rollback_discards_buffered_writes(connect):
+    connection = connect('bitable+pybitable://:token@host/app?buffered=true')
+    connection.bot.tables['tbl'] = make_records('r', [1])
+    cursor = connection.cursor()
+    cursor.execute("update tbl set a='1' where record_id='r0'")
+    cursor.execute("delete from tbl where a='r0'")
+    connection.rollback()
+    connection.commit()
+    assert [c[0] for c in connection.bot.calls] == ['records']